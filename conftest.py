@@ -0,0 +1 @@
+# Makes the top-level modules (server.py, storage.py) importable from tests/.
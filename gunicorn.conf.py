@@ -0,0 +1,49 @@
+"""Gunicorn settings for serving ``server:app``.
+
+Usage: gunicorn -c gunicorn.conf.py server:app
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(
+    os.environ.get("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1)
+)
+worker_class = "gthread"
+# Threads overlap the blocking storage download and Docker run inside each
+# worker; server.py caps container runs host-wide (FAAS_MAX_CONCURRENT).
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
+# Container runs can be long; don't let the arbiter kill busy workers.
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 300))
+# Import server.py, and in when_ready its client libraries, once in the
+# master so workers share them copy-on-write. Workers must also inherit
+# server.py's run slots for the host-wide cap to hold.
+preload_app = True
+
+
+def when_ready(server):
+    import server as faas_server
+
+    faas_server.load_client_libraries()
+    # Pull the runtime image once per host, before any worker needs it; a
+    # failure here stops the server from starting.
+    faas_server.prepare_image()
+    # No worker exists yet, so any runner still around was left by a killed server.
+    faas_server.remove_runners()
+
+
+def post_fork(server, worker):
+    # Sockets held by the storage client and Docker client's HTTP session
+    # don't survive fork cleanly, so make sure each worker builds its own.
+    import server as faas_server
+
+    faas_server.reset_clients()
+    faas_server.warm_up()
+
+
+def child_exit(server, worker):
+    # Workers killed by the timeout, the OOM killer or SIGKILL never run their
+    # atexit drain, so the master removes whatever runners they left.
+    import server as faas_server
+
+    faas_server.remove_runners(worker.pid)
@@ -0,0 +1,215 @@
+"""Fork server run inside warm-pool runner containers.
+
+server.py copies this into each runner container, starts it as the
+container's command and keeps its stdin and stdout attached. It imports the
+modules listed in FAAS_PRELOAD once, then serves one script at a time: every
+script runs as script.py in the working directory (/app), in a child forked
+from this process. Scripts start with those modules already imported and
+skip interpreter start-up, but can't change what the next script sees:
+the working directory is emptied before each run and the child's process
+group is killed after it.
+
+Protocol (lengths are 4-byte big-endian):
+    stdin:  length + script source, once per run
+    stdout: length + JSON {"exit_code", "stdout", "stderr"}, once per run
+"""
+import importlib
+import json
+import os
+import runpy
+import selectors
+import shutil
+import signal
+import struct
+import sys
+import time
+import traceback
+
+APP_DIR = os.getcwd()
+SCRIPT_PATH = os.path.join(APP_DIR, "script.py")
+# How long to keep reading output held open by processes that left the
+# script's process group after the script itself exits.
+DRAIN_TIMEOUT = 1
+
+
+def preload():
+    for name in os.environ.get("FAAS_PRELOAD", "").split(","):
+        name = name.strip()
+        if not name:
+            continue
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            # Not installed in this image; scripts that need it will say so.
+            print(f"runner: can't preload {name}", file=sys.stderr)
+
+
+def read_exactly(fd, n):
+    data = b""
+    while len(data) < n:
+        chunk = os.read(fd, n - len(data))
+        if not chunk:
+            raise EOFError
+        data += chunk
+    return data
+
+
+def write_all(fd, data):
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def clear_app_dir():
+    for entry in os.scandir(APP_DIR):
+        if entry.is_dir(follow_symlinks=False):
+            shutil.rmtree(entry.path, ignore_errors=True)
+        else:
+            try:
+                os.unlink(entry.path)
+            except FileNotFoundError:
+                pass
+
+
+def exit_code(code):
+    """Maps a SystemExit code to a process exit status, as the interpreter does."""
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code & 0xFF
+    print(code, file=sys.stderr)
+    return 1
+
+
+def run_script(out_w, err_w):
+    """Runs script.py in the forked child; never returns."""
+    code = 1
+    try:
+        os.setpgid(0, 0)
+        os.dup2(out_w, 1)
+        os.dup2(err_w, 2)
+        os.close(out_w)
+        os.close(err_w)
+        sys.argv = [SCRIPT_PATH]
+        sys.path[0] = APP_DIR
+        try:
+            runpy.run_path(SCRIPT_PATH, run_name="__main__")
+            code = 0
+        except SystemExit as e:
+            code = exit_code(e.code)
+        except BaseException:
+            # Start the traceback at the script, as `python script.py` would.
+            etype, value, tb = sys.exc_info()
+            while tb is not None and tb.tb_frame.f_code.co_filename != SCRIPT_PATH:
+                tb = tb.tb_next
+            traceback.print_exception(etype, value, tb)
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(code)
+
+
+def kill_group(pgid):
+    try:
+        os.killpg(pgid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def reap():
+    # As the container's PID 1 this process inherits orphans, so collect them.
+    try:
+        while os.waitpid(-1, os.WNOHANG)[0]:
+            pass
+    except ChildProcessError:
+        pass
+
+
+def collect(pid, out_r, err_r):
+    """Reads the child's output until it exits; returns (status, stdout, stderr)."""
+    output = {out_r: bytearray(), err_r: bytearray()}
+    selector = selectors.DefaultSelector()
+    for fd in output:
+        selector.register(fd, selectors.EVENT_READ)
+    status = None
+    deadline = None
+    while selector.get_map() and (deadline is None or time.monotonic() < deadline):
+        for key, _ in selector.select(timeout=0.1):
+            data = os.read(key.fd, 65536)
+            if data:
+                output[key.fd] += data
+            else:
+                selector.unregister(key.fd)
+        if status is None:
+            done, wait_status = os.waitpid(pid, os.WNOHANG)
+            if done:
+                status = wait_status
+                # Background processes would keep the pipes open; they go
+                # with the script.
+                kill_group(pid)
+                deadline = time.monotonic() + DRAIN_TIMEOUT
+    selector.close()
+    if status is None:
+        status = os.waitpid(pid, 0)[1]
+    kill_group(pid)
+    return status, bytes(output[out_r]), bytes(output[err_r])
+
+
+def serve(proto_in, proto_out):
+    while True:
+        try:
+            (length,) = struct.unpack(">I", read_exactly(proto_in, 4))
+            source = read_exactly(proto_in, length)
+        except EOFError:
+            # server.py closed the attach socket; its worker is gone.
+            return
+        clear_app_dir()
+        with open(SCRIPT_PATH, "wb") as f:
+            f.write(source)
+
+        out_r, out_w = os.pipe()
+        err_r, err_w = os.pipe()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            for fd in (out_r, err_r, proto_in, proto_out):
+                os.close(fd)
+            run_script(out_w, err_w)
+        os.close(out_w)
+        os.close(err_w)
+        try:
+            status, stdout, stderr = collect(pid, out_r, err_r)
+        finally:
+            os.close(out_r)
+            os.close(err_r)
+        reap()
+
+        record = json.dumps(
+            {
+                "exit_code": os.waitstatus_to_exitcode(status),
+                "stdout": stdout.decode("utf-8", "replace"),
+                "stderr": stderr.decode("utf-8", "replace"),
+            }
+        ).encode("utf-8")
+        write_all(proto_out, struct.pack(">I", len(record)) + record)
+
+
+def main():
+    # Keep the protocol streams to ourselves: anything else that reads stdin
+    # gets EOF, and anything printed to stdout (say, by a preloaded module)
+    # ends up on stderr instead of corrupting a record.
+    proto_in = os.dup(0)
+    proto_out = os.dup(1)
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.close(devnull)
+    os.dup2(2, 1)
+    preload()
+    serve(proto_in, proto_out)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,22 @@
 import os
-import uuid
-import tempfile
-import shutil
+import io
+import hashlib
+import socket
+import struct
+import tarfile
+import time
 import logging
-from flask import Flask, request, jsonify
-import docker
-from docker.errors import ContainerError, ImageNotFound, APIError
+import multiprocessing
+import queue
+import threading
+import atexit
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from cachetools import TTLCache
+from flask import Flask, Response, request
+import orjson
 from dotenv import load_dotenv
-import swiftclient
+from storage import NotModified, ObjectNotFound, S3Store, SwiftStore
 
 load_dotenv()
 
@@ -18,106 +27,369 @@ OS_PASSWORD = os.environ.get("OS_PASSWORD")
 OS_PROJECT_NAME = os.environ.get("OS_PROJECT_NAME")
 OS_USER_DOMAIN_NAME = os.environ.get("OS_USER_DOMAIN_NAME", "Default")
 OS_PROJECT_DOMAIN_NAME = os.environ.get("OS_PROJECT_DOMAIN_NAME", "Default")
+# Where function code is stored: "swift" (OS_* settings) or "s3" (standard
+# AWS credential chain). DEFAULT_CONTAINER_NAME is the container or bucket.
+FAAS_BACKEND = os.environ.get("FAAS_BACKEND", "swift").lower()
+S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL")
+S3_POOL_SIZE = int(os.environ.get("S3_POOL_SIZE", 64))
 DEFAULT_CONTAINER_NAME = os.environ.get("DEFAULT_CONTAINER_NAME", "faas-code")
+# Set to faas-runner:py310 (built from runner/Dockerfile) for preinstalled libraries.
 DEFAULT_DOCKER_IMAGE = os.environ.get("DEFAULT_DOCKER_IMAGE", "python:3.10-slim")
+# What warm-pool runners run for each script; see runner/runner.py.
 DEFAULT_CONTAINER_COMMAND = ["python", "/app/script.py"]
+# Fresh containers read the script from stdin instead of a mounted file.
+STDIN_CONTAINER_COMMAND = ["python", "-"]
+# Number of long-lived runner containers per worker process; 0 disables the
+# warm pool and runs every request in a fresh container. Runners fork each
+# script from an interpreter that already imported RUNNER_PRELOAD, clearing
+# /app before it and killing its process group after. Files written outside
+# /app, and processes that leave the group, are still there for the next one.
+WARM_POOL_SIZE = int(os.environ.get("WARM_POOL_SIZE", 0))
+# Comma-separated modules runners import once at start-up; ones missing from
+# the image are skipped. faas-runner:py310 (runner/Dockerfile) has these.
+RUNNER_PRELOAD = os.environ.get("RUNNER_PRELOAD", "numpy,pandas,requests")
+# Size of the tmpfs mounted at /app in fresh containers.
+CONTAINER_TMPFS_SIZE = os.environ.get("CONTAINER_TMPFS_SIZE", "16m")
+# Keep-alive connections to the Docker daemon shared by all request threads.
+DOCKER_POOL_SIZE = int(os.environ.get("DOCKER_POOL_SIZE", 64))
+# Threads used to prepare containers while the script downloads.
+PREPARE_WORKERS = int(os.environ.get("PREPARE_WORKERS", 32))
+# Container runs allowed at once across the host; extra requests wait up to
+# RUN_QUEUE_TIMEOUT seconds for a slot, then get a 429. The slots are created
+# at import, so with preload_app every Gunicorn worker shares the same ones.
+MAX_CONCURRENT_RUNS = int(os.environ.get("FAAS_MAX_CONCURRENT", os.cpu_count()))
+RUN_QUEUE_TIMEOUT = float(os.environ.get("FAAS_QUEUE_TIMEOUT", 30))
+# Seconds between background re-pulls of DEFAULT_DOCKER_IMAGE; 0 disables.
+IMAGE_REFRESH_INTERVAL = int(os.environ.get("IMAGE_REFRESH_INTERVAL", 0))
+# Largest accepted request body; anything bigger is rejected with a 413.
+MAX_UPLOAD_SIZE = int(os.environ.get("MAX_UPLOAD_SIZE", 64 * 1024 * 1024))
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# Seconds a /list-objects listing is served from memory.
+LIST_CACHE_TTL = float(os.environ.get("LIST_CACHE_TTL", 3))
+CODE_CACHE_SIZE = int(os.environ.get("CODE_CACHE_SIZE", 1024))
+CODE_CACHE_TTL = int(os.environ.get("CODE_CACHE_TTL", 300))
 
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
 )
 
 app = Flask(__name__)
+app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_SIZE
 
-swift_conn = None
-docker_client = None
 
-try:
-    if not all([OS_AUTH_URL, OS_USERNAME, OS_PASSWORD, OS_PROJECT_NAME]):
-        logging.warning(
-            "Swift environment variables not fully set. Swift functionality disabled."
-        )
+def fastjson(obj, status=200):
+    """JSON response serialized with orjson; cheaper than jsonify for large stdout."""
+    return Response(orjson.dumps(obj), status=status, mimetype="application/json")
+
+
+@app.errorhandler(413)
+def request_too_large(e):
+    return fastjson(
+        {"error": f"Request exceeds the {MAX_UPLOAD_SIZE} byte upload limit."}, 413
+    )
+
+
+# ID of DEFAULT_DOCKER_IMAGE and when it was resolved; see get_image().
+image_cache = {"id": None, "ts": None}
+warm_pool = None
+# Runners that died and couldn't be replaced yet; take_runner() retries them.
+warm_pool_missing = 0
+warm_pool_lock = threading.Lock()
+# store.url(key) -> (etag, bytes) of recently downloaded scripts.
+code_cache = TTLCache(maxsize=CODE_CACHE_SIZE, ttl=CODE_CACHE_TTL)
+code_cache_lock = threading.RLock()
+# Last /list-objects listing. list_cache_lock only guards the dict; refreshes
+# are serialized by list_refresh_lock so concurrent callers share one storage
+# round trip without blocking /upload's invalidation. "generation" is bumped
+# on every invalidation so a listing started before an upload isn't cached.
+list_cache = {"ts": None, "keys": [], "etag": "", "generation": 0}
+list_cache_lock = threading.Lock()
+list_refresh_lock = threading.Lock()
+run_slots = multiprocessing.BoundedSemaphore(MAX_CONCURRENT_RUNS)
+prepare_executor = ThreadPoolExecutor(
+    max_workers=PREPARE_WORKERS, thread_name_prefix="prepare"
+)
+
+
+# Storage and docker client libraries pull in large dependency trees
+# (keystoneauth/botocore, requests, urllib3, ...), so they are imported and
+# connected on first use rather than at module import. Under Gunicorn the
+# master imports them once (load_client_libraries) and workers only connect.
+def load_client_libraries():
+    """Imports the Docker and FAAS_BACKEND client libraries without connecting."""
+    import docker  # noqa: F401
+
+    if FAAS_BACKEND == "s3":
+        import boto3  # noqa: F401
     else:
-        swift_conn = swiftclient.Connection(
-            authurl=OS_AUTH_URL,
-            user=OS_USERNAME,
-            key=OS_PASSWORD,
-            tenant_name=OS_PROJECT_NAME,
-            auth_version="3",
-            os_options={
-                "user_domain_name": OS_USER_DOMAIN_NAME,
-                "project_domain_name": OS_PROJECT_DOMAIN_NAME,
-            },
+        import swiftclient  # noqa: F401
+
+
+@functools.lru_cache(maxsize=1)
+def get_store():
+    """Returns this process's object store for FAAS_BACKEND, or None if unavailable."""
+    try:
+        if FAAS_BACKEND == "s3":
+            store = S3Store(
+                DEFAULT_CONTAINER_NAME,
+                endpoint_url=S3_ENDPOINT_URL,
+                max_pool_connections=S3_POOL_SIZE,
+            )
+            logging.info(f"S3 client initialized for bucket: {DEFAULT_CONTAINER_NAME}")
+            return store
+        if FAAS_BACKEND != "swift":
+            logging.error(f"Unknown FAAS_BACKEND '{FAAS_BACKEND}'. Storage disabled.")
+            return None
+        if not all([OS_AUTH_URL, OS_USERNAME, OS_PASSWORD, OS_PROJECT_NAME]):
+            logging.warning(
+                "Swift environment variables not fully set. Swift functionality disabled."
+            )
+            return None
+        store = SwiftStore(
+            DEFAULT_CONTAINER_NAME,
+            auth_url=OS_AUTH_URL,
+            username=OS_USERNAME,
+            password=OS_PASSWORD,
+            project_name=OS_PROJECT_NAME,
+            user_domain_name=OS_USER_DOMAIN_NAME,
+            project_domain_name=OS_PROJECT_DOMAIN_NAME,
         )
         logging.info(f"Swift client initialized for endpoint: {OS_AUTH_URL}")
+        return store
+    except Exception as e:
+        logging.error(f"Error initializing {FAAS_BACKEND} storage client: {e}")
+        return None
 
-    docker_client = docker.from_env()
-    docker_client.ping()
-    logging.info("Docker client initialized successfully.")
 
-except Exception as e:
-    logging.error(f"Error initializing clients: {e}")
-    swift_conn = None
-    docker_client = None
+@functools.lru_cache(maxsize=1)
+def get_docker():
+    """Returns this process's Docker client, or None if the daemon is unreachable."""
+    try:
+        import docker
 
-# --- Helper Function: Download Code from Swift ---
-def download_code(container, object_name, download_path):
-    """Downloads code from Swift to a local path."""
-    if not swift_conn:
-        raise ConnectionError("Swift client is not initialized.")
+        docker_client = docker.from_env(max_pool_size=DOCKER_POOL_SIZE)
+        docker_client.ping()
+        logging.info("Docker client initialized successfully.")
+        return docker_client
+    except Exception as e:
+        logging.error(f"Error initializing Docker client: {e}")
+        return None
+
+
+def get_image():
+    """Returns the ID (sha256) of DEFAULT_DOCKER_IMAGE, pulling it if missing.
+
+    Creating containers from the ID lets the daemon skip tag resolution. The
+    ID is re-resolved every IMAGE_REFRESH_INTERVAL seconds (when set) so that
+    workers pick up the image re-pulled by refresh_image().
+    """
+    from docker.errors import ImageNotFound
+
+    ts = image_cache["ts"]
+    if image_cache["id"] and (
+        not IMAGE_REFRESH_INTERVAL or time.monotonic() - ts < IMAGE_REFRESH_INTERVAL
+    ):
+        return image_cache["id"]
+
+    docker_client = get_docker()
+    if not docker_client:
+        raise ConnectionError("Docker client is not initialized.")
     try:
-        logging.info(f"Attempting to download swift://{container}/{object_name}")
-        headers, obj_contents = swift_conn.get_object(container, object_name)
-        with open(download_path, "wb") as f:
-            f.write(obj_contents)
-        logging.info(f"Successfully downloaded code to {download_path}")
-        return True
-    except swiftclient.exceptions.ClientException as e:
-        if e.http_status == 404:
-            logging.error(f"Swift object not found: swift://{container}/{object_name}")
-        else:
-            logging.error(f"Error downloading from Swift: {e}")
-        return False
+        image = docker_client.images.get(DEFAULT_DOCKER_IMAGE)
+    except ImageNotFound:
+        logging.info(f"Pulling Docker image '{DEFAULT_DOCKER_IMAGE}'")
+        image = docker_client.images.pull(DEFAULT_DOCKER_IMAGE)
+    if image.id != image_cache["id"]:
+        logging.info(f"Resolved image '{DEFAULT_DOCKER_IMAGE}' to {image.id}")
+    image_cache.update(id=image.id, ts=time.monotonic())
+    return image.id
+
+
+def refresh_image():
+    """Re-pulls DEFAULT_DOCKER_IMAGE every IMAGE_REFRESH_INTERVAL seconds."""
+    while True:
+        time.sleep(IMAGE_REFRESH_INTERVAL)
+        try:
+            get_docker().images.pull(DEFAULT_DOCKER_IMAGE)
+        except Exception as e:
+            logging.error(f"Error refreshing Docker image '{DEFAULT_DOCKER_IMAGE}': {e}")
+
+
+def prepare_image():
+    """Makes sure DEFAULT_DOCKER_IMAGE is on this host; run once per host.
+
+    Gunicorn calls this in the master before forking, so the boot-time pull and
+    the optional periodic re-pull aren't repeated by every worker. A failed
+    pull raises, so misconfiguration shows up at boot instead of on /run.
+    """
+    get_image()
+    if IMAGE_REFRESH_INTERVAL:
+        threading.Thread(target=refresh_image, name="image-refresh", daemon=True).start()
+
+
+def warm_up():
+    """Connects Docker, resolves the image and fills the warm pool off the request path."""
+    if not get_docker():
+        raise ConnectionError("Docker client is not initialized.")
+    image = get_image()
+    if WARM_POOL_SIZE:
+        get_warm_pool(image)
+
+
+def reset_clients():
+    """Drops the cached clients so they are rebuilt in the calling process.
+
+    Called from Gunicorn's ``post_fork`` hook, since the sockets held by these
+    clients must not be shared across forked workers.
+    """
+    global warm_pool, warm_pool_missing
+    get_store.cache_clear()
+    get_docker.cache_clear()
+    image_cache["id"] = None
+    # Runners belong to the process that started them; warm_up() builds new ones.
+    warm_pool = None
+    warm_pool_missing = 0
+
+# --- Helper Function: Download Code from Storage ---
+def download_code(object_key):
+    """Downloads code from the object store into memory; returns None on failure.
+
+    Recently fetched objects are kept in an in-memory cache and revalidated
+    with a conditional GET, so an unchanged object costs a single 304.
+    """
+    store = get_store()
+    if not store:
+        raise ConnectionError("Storage client is not initialized.")
+    location = store.url(object_key)
+    with code_cache_lock:
+        cached = code_cache.get(location)
+    try:
+        logging.info(f"Attempting to download {location}")
+        etag, obj_contents = store.get_bytes(
+            object_key, etag=cached[0] if cached is not None else None
+        )
+        with code_cache_lock:
+            code_cache[location] = (etag, obj_contents)
+        logging.info(f"Successfully downloaded {len(obj_contents)} bytes of code")
+        return obj_contents
+    except NotModified:
+        logging.info(f"Using cached code for {location}")
+        # Restart the TTL, or a script that runs constantly would still drop
+        # out of the cache and pay for a full GET every CODE_CACHE_TTL.
+        with code_cache_lock:
+            code_cache[location] = cached
+        return cached[1]
+    except ObjectNotFound:
+        logging.error(f"Object not found: {location}")
+        return None
+    except Exception as e:
+        logging.error(f"An unexpected error occurred during download of {location}: {e}")
+        return None
+
+
+# --- Helper Functions: Object Listing Cache ---
+def cached_listing():
+    """Returns the cached (keys, etag), or (None, None) when stale."""
+    with list_cache_lock:
+        ts = list_cache["ts"]
+        if ts is None or time.monotonic() - ts >= LIST_CACHE_TTL:
+            return None, None
+        return list_cache["keys"], list_cache["etag"]
+
+
+def refresh_listing(store):
+    """Lists the store and caches the result unless an upload raced it."""
+    with list_cache_lock:
+        generation = list_cache["generation"]
+    # List all objects in the default container
+    object_keys = store.list()
+    digest = hashlib.blake2b(digest_size=16)
+    for key in object_keys:
+        digest.update(key.encode("utf-8") + b"\n")
+    etag = digest.hexdigest()
+    with list_cache_lock:
+        if list_cache["generation"] == generation:
+            list_cache.update(ts=time.monotonic(), keys=object_keys, etag=etag)
+    return object_keys, etag
+
+
+# --- Helper Functions: Run Code in Container ---
+def create_container(image, command):
+    """Creates (but doesn't start) a container that reads its script from stdin."""
+    api = get_docker().api
+    return api.create_container(
+        image=image,
+        command=command,
+        working_dir="/app",
+        stdin_open=True,
+        stdin_once=True,
+        host_config=api.create_host_config(
+            # Keep anything the script writes in RAM instead of overlay2 copy-up.
+            tmpfs={"/app": f"size={CONTAINER_TMPFS_SIZE},mode=1777"},
+        ),
+    )["Id"]
+
+
+def start_with_stdin(api, container_id, script_bytes):
+    """Starts a created container and pipes the script into its stdin."""
+    sock = api.attach_socket(container_id, params={"stdin": 1, "stream": 1})
+    api.start(container_id)
+    # Over the unix socket docker-py hands back a SocketIO wrapper whose
+    # response object keeps the socket alive, so close() alone doesn't reach
+    # the daemon; https daemons return the SSL socket itself.
+    raw = getattr(sock, "_sock", sock)
+    try:
+        raw.sendall(script_bytes)
+        # Half-close so the script sees EOF on stdin right away.
+        raw.shutdown(socket.SHUT_WR)
+    finally:
+        sock.close()
+
+
+def discard_container(future):
+    """Done-callback that removes a prepared container nobody is going to run."""
+    try:
+        get_docker().api.remove_container(future.result(), force=True)
     except Exception as e:
-        logging.error(f"An unexpected error occurred during Swift download: {e}")
-        return False
+        logging.error(f"Error discarding prepared container: {e}")
+
+
+def run_in_container(image, command, script_bytes, prepared=None):
+    """Runs the script in a fresh container, feeding it to the command's stdin.
+
+    ``prepared`` is an optional Future of a create_container() call issued
+    while the script was downloading; a new container is created otherwise.
+    """
+    from docker.errors import ContainerError, ImageNotFound, APIError
 
-# --- Helper Function: Run Code in Container (unchanged) ---
-def run_in_container(image, command, code_dir):
+    docker_client = get_docker()
     if not docker_client:
         raise ConnectionError("Docker client is not initialized.")
 
-    host_code_path = os.path.abspath(code_dir)
-    container_code_path = "/app"
     logging.info(
         f"Running image '{image}' with command '{command}'"
     )
-    logging.info(
-        f"Mounting host path '{host_code_path}' to container path '{container_code_path}'"
-    )
 
+    api = docker_client.api
+    container_id = None
     try:
-        container = docker_client.containers.run(
-            image=image,
-            command=command,
-            volumes={host_code_path: {"bind": container_code_path, "mode": "ro"}},
-            working_dir=container_code_path,
-            stdout=True,
-            stderr=True,
-            remove=True,
-            detach=False,
-        )
-        stdout = container.decode("utf-8")
-        stderr = ""
+        if prepared is not None:
+            container_id = prepared.result()
+        else:
+            container_id = create_container(image, command)
+        start_with_stdin(api, container_id, script_bytes)
+
+        exit_code = api.wait(container_id)["StatusCode"]
+        stdout = api.logs(container_id, stdout=True, stderr=False).decode("utf-8")
+        stderr = api.logs(container_id, stdout=False, stderr=True).decode("utf-8")
+
+        if exit_code != 0:
+            error = ContainerError(container_id, exit_code, command, image, stderr)
+            logging.error(f"Container execution error: {error}")
+            return stdout, stderr, error
         logging.info(f"Container executed. Output:\n{stdout}")
         return stdout, stderr, None
 
-    except ContainerError as e:
-        logging.error(f"Container execution error: {e}")
-        return (
-            e.stdout.decode("utf-8") if e.stdout else "",
-            e.stderr.decode("utf-8") if e.stderr else str(e),
-            e,
-        )
     except ImageNotFound:
         logging.error(f"Docker image not found: {image}")
         return "", f"Docker image not found: {image}", ImageNotFound(image)
@@ -127,160 +399,519 @@ def run_in_container(image, command, code_dir):
     except Exception as e:
         logging.error(f"An unexpected error occurred during container run: {e}")
         return "", f"Unexpected container run error: {e}", e
+    finally:
+        if container_id is not None:
+            try:
+                api.remove_container(container_id, force=True)
+            except Exception as e:
+                logging.error(f"Error removing container {container_id[:12]}: {e}")
 
-# --- API Endpoint ---
-@app.route("/run", methods=["GET"])
-def run_function():
-    if not swift_conn or not docker_client:
-        return (
-            jsonify(
-                {
-                    "error": "Server not fully initialized (Swift or Docker client missing)"
-                }
-            ),
-            503,
+# --- Helper Functions: Warm Runner Pool ---
+# The pid label names the process that started a runner, so Gunicorn's master
+# can remove the runners of a worker that died without cleaning up.
+RUNNER_LABEL = "faas.runner"
+RUNNER_PID_LABEL = "faas.runner.pid"
+
+
+# runner/runner.py is copied into every runner and started as its command.
+RUNNER_SOURCE_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "runner", "runner.py"
+)
+RUNNER_COMMAND = ["python", "/faas_runner.py"]
+
+
+@functools.lru_cache(maxsize=1)
+def runner_archive():
+    """Returns an in-memory tar holding runner.py as faas_runner.py, for put_archive."""
+    with open(RUNNER_SOURCE_PATH, "rb") as f:
+        source = f.read()
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w") as tar:
+        info = tarfile.TarInfo("faas_runner.py")
+        info.size = len(source)
+        info.mode = 0o644
+        tar.addfile(info, io.BytesIO(source))
+    return buf.getvalue()
+
+
+class Runner:
+    """A runner container and the socket attached to its fork server's stdin/stdout."""
+
+    def __init__(self, container, sock):
+        self.container = container
+        self.short_id = container.short_id
+        self.sock = sock
+        # See start_with_stdin() for why the wrapped socket is used directly.
+        self.raw = getattr(sock, "_sock", sock)
+
+    def run(self, script_bytes):
+        """Sends the script to the fork server and returns its result record."""
+        from docker.utils.socket import STDOUT, next_frame_header, read_exactly
+
+        self.raw.sendall(struct.pack(">I", len(script_bytes)) + script_bytes)
+        # Docker multiplexes stdout and stderr into frames; the record may span
+        # several stdout frames, and stderr only carries the runner's own logs.
+        buf = bytearray()
+        while len(buf) < 4 or len(buf) < 4 + struct.unpack(">I", buf[:4])[0]:
+            stream, size = next_frame_header(self.raw)
+            if size < 0:
+                raise EOFError(f"Runner {self.short_id} closed its output")
+            data = read_exactly(self.raw, size)
+            if stream == STDOUT:
+                buf += data
+            else:
+                logging.warning(
+                    f"Runner {self.short_id}: {data.decode('utf-8', 'replace').rstrip()}"
+                )
+        return orjson.loads(bytes(buf[4:]))
+
+    def stop(self):
+        stop_runner(self.container)
+        try:
+            self.sock.close()
+        except Exception:
+            pass
+
+
+def start_runner(image):
+    """Starts a runner container whose fork server waits for scripts on stdin."""
+    docker_client = get_docker()
+    container = docker_client.containers.create(
+        image=image,
+        command=RUNNER_COMMAND,
+        working_dir="/app",
+        stdin_open=True,
+        environment={"FAAS_PRELOAD": RUNNER_PRELOAD},
+        labels={RUNNER_LABEL: "1", RUNNER_PID_LABEL: str(os.getpid())},
+    )
+    sock = None
+    try:
+        container.put_archive("/", runner_archive())
+        # Attach before starting so none of the runner's output is missed.
+        sock = docker_client.api.attach_socket(
+            container.id, params={"stdin": 1, "stdout": 1, "stderr": 1, "stream": 1}
         )
+        container.start()
+    except Exception:
+        stop_runner(container)
+        if sock is not None:
+            sock.close()
+        raise
+    logging.info(f"Started runner container {container.short_id}")
+    return Runner(container, sock)
+
+
+def stop_runner(container):
+    try:
+        container.remove(force=True)
+    except Exception as e:
+        logging.error(f"Error removing runner container {container.short_id}: {e}")
+
+
+def get_warm_pool(image):
+    """Returns this process's queue of idle runners, creating it if needed.
+
+    warm_up() builds the pool at process start; building it here is only a
+    fallback for processes that skipped warm_up().
+    """
+    global warm_pool
+    with warm_pool_lock:
+        if warm_pool is None:
+            pool = queue.Queue()
+            for _ in range(WARM_POOL_SIZE):
+                pool.put(start_runner(image))
+            warm_pool = pool
+            logging.info(f"Warm pool ready with {WARM_POOL_SIZE} runner(s)")
+        return warm_pool
+
+
+def drain_warm_pool():
+    if warm_pool is None:
+        return
+    while True:
+        try:
+            warm_pool.get_nowait().stop()
+        except queue.Empty:
+            break
 
-    container_name = DEFAULT_CONTAINER_NAME
-    object_key = str(request.args.get("KEY"))
-    docker_image = DEFAULT_DOCKER_IMAGE
-    container_command = DEFAULT_CONTAINER_COMMAND
 
-    temp_dir = tempfile.mkdtemp(prefix="faas_code_")
-    local_code_path = os.path.join(temp_dir, "script.py")
-    logging.info(f"Created temporary directory: {temp_dir}")
+atexit.register(drain_warm_pool)
 
+
+def remove_runners(pid=None):
+    """Removes the runners started by process ``pid``, or every runner on the host.
+
+    drain_warm_pool() only runs when a process exits cleanly. Gunicorn's master
+    calls this when a worker exits, and at boot for runners left behind by an
+    earlier server; that sweep assumes one server per Docker host.
+    """
+    docker_client = get_docker()
+    if not docker_client:
+        return
+    label = RUNNER_LABEL if pid is None else f"{RUNNER_PID_LABEL}={pid}"
+    try:
+        containers = docker_client.containers.list(all=True, filters={"label": label})
+    except Exception as e:
+        logging.error(f"Error listing runner containers: {e}")
+        return
+    for container in containers:
+        stop_runner(container)
+
+
+def take_runner(pool, image):
+    """Returns an idle runner, first retrying any runner that couldn't be replaced.
+
+    Raises queue.Empty if none frees up within RUN_QUEUE_TIMEOUT seconds.
+    """
+    global warm_pool_missing
+    with warm_pool_lock:
+        replace = warm_pool_missing > 0
+        if replace:
+            warm_pool_missing -= 1
+    if replace:
+        try:
+            return start_runner(image)
+        except Exception:
+            with warm_pool_lock:
+                warm_pool_missing += 1
+            raise
+    return pool.get(timeout=RUN_QUEUE_TIMEOUT)
+
+
+def run_in_warm_container(image, command, script_bytes):
+    """Runs the script in an idle runner's fork server instead of a new container."""
+    from docker.errors import ContainerError
+
+    if not get_docker():
+        raise ConnectionError("Docker client is not initialized.")
+
+    global warm_pool_missing
+    pool = get_warm_pool(image)
+    try:
+        runner = take_runner(pool, image)
+    except queue.Empty:
+        logging.error(f"No warm runner became idle within {RUN_QUEUE_TIMEOUT}s")
+        error = TimeoutError("No warm runner available.")
+        return "", str(error), error
+    except Exception as e:
+        logging.error(f"Error starting replacement runner container: {e}")
+        return "", f"Docker API error: {e}", e
+    healthy = False
     try:
-        if not download_code(container_name, object_key, local_code_path):
+        # Stream the script in over the attach socket; nothing touches the host FS.
+        logging.info(f"Running '{command}' in runner {runner.short_id}")
+        result = runner.run(script_bytes)
+        # The script ran in a forked child, so even a failed one leaves the
+        # runner clean.
+        healthy = True
+        stdout, stderr = result["stdout"], result["stderr"]
+        exit_code = result["exit_code"]
+
+        if exit_code != 0:
+            logging.error(f"Runner script exited with status {exit_code}")
             return (
-                jsonify(
+                stdout,
+                stderr,
+                ContainerError(runner.container, exit_code, command, image, stderr),
+            )
+        logging.info(f"Runner executed. Output:\n{stdout}")
+        return stdout, stderr, None
+
+    except Exception as e:
+        logging.error(f"An unexpected error occurred during runner exec: {e}")
+        return "", f"Unexpected container run error: {e}", e
+    finally:
+        if healthy:
+            pool.put(runner)
+        else:
+            # A runner that broke the protocol may be dead or mid-script.
+            runner.stop()
+            try:
+                pool.put(start_runner(image))
+            except Exception as e:
+                logging.error(f"Error replacing runner container: {e}")
+                with warm_pool_lock:
+                    warm_pool_missing += 1
+
+# --- API Endpoint ---
+class RunAborted(Exception):
+    """Ends a /run or /run-stream request early with the given response."""
+
+    def __init__(self, response):
+        super().__init__(response.status)
+        self.response = response
+
+
+def take_run_slot():
+    """Acquires a run slot, or raises RunAborted with a 429 after RUN_QUEUE_TIMEOUT."""
+    if not run_slots.acquire(timeout=RUN_QUEUE_TIMEOUT):
+        response = fastjson({"error": "Too many concurrent executions."}, 429)
+        response.headers["Retry-After"] = "1"
+        raise RunAborted(response)
+
+
+def begin_run(object_key, prepare):
+    """Shared front half of /run and /run-stream.
+
+    Downloads the script and takes a run slot. If ``prepare`` is set, the slot
+    is taken first and a fresh container is created while the script
+    downloads; otherwise the slot is taken after the download. Returns
+    ``(image, script_bytes, prepared)``; from then on the caller owns the slot
+    and the prepared container Future. Raises RunAborted with the error
+    response otherwise, having released whatever it took.
+    """
+    if not get_store() or not get_docker():
+        raise RunAborted(
+            fastjson(
+                {
+                    "error": "Server not fully initialized (storage or Docker client missing)"
+                },
+                503,
+            )
+        )
+
+    prepared = None
+    slot_held = False
+    try:
+        image = get_image()
+        if prepare:
+            # The slot bounds the container created below too, so queued and
+            # rejected requests never reach the daemon.
+            take_run_slot()
+            slot_held = True
+            # Creating the container doesn't depend on the script, so overlap it
+            # with the download instead of paying for both back to back.
+            prepared = prepare_executor.submit(
+                create_container, image, STDIN_CONTAINER_COMMAND
+            )
+
+        script_bytes = download_code(object_key)
+        if script_bytes is None:
+            raise RunAborted(
+                fastjson(
                     {
-                        "error": f"Failed to download code from swift://{container_name}/{object_key}"
-                    }
-                ),
-                500,
+                        "error": f"Failed to download code from {get_store().url(object_key)}"
+                    },
+                    500,
+                )
             )
+        if not slot_held:
+            # Warm runners already exist, so only the run itself is throttled.
+            take_run_slot()
+        return image, script_bytes, prepared
+    except BaseException:
+        if prepared is not None:
+            prepared.add_done_callback(discard_container)
+        if slot_held:
+            run_slots.release()
+        raise
+
+
+@app.route("/run", methods=["GET"])
+def run_function():
+    object_key = str(request.args.get("KEY"))
 
-        stdout, stderr, error = run_in_container(
-            docker_image, container_command, temp_dir
+    try:
+        docker_image, script_bytes, prepared = begin_run(
+            object_key, prepare=not WARM_POOL_SIZE
         )
+        try:
+            if WARM_POOL_SIZE:
+                stdout, stderr, error = run_in_warm_container(
+                    docker_image, DEFAULT_CONTAINER_COMMAND, script_bytes
+                )
+            else:
+                stdout, stderr, error = run_in_container(
+                    docker_image, STDIN_CONTAINER_COMMAND, script_bytes, prepared
+                )
+        finally:
+            run_slots.release()
 
         if error:
-            return (
-                jsonify(
-                    {
-                        "error": f"Execution failed: {str(error)}",
-                        "stdout": stdout,
-                        "stderr": stderr,
-                    }
-                ),
+            return fastjson(
+                {
+                    "error": f"Execution failed: {str(error)}",
+                    "stdout": stdout,
+                    "stderr": stderr,
+                },
                 500,
             )
         else:
-            return (
-                jsonify(
-                    {
-                        "message": "Execution successful",
-                        "stdout": stdout,
-                        "stderr": stderr,
-                    }
-                ),
+            return fastjson(
+                {
+                    "message": "Execution successful",
+                    "stdout": stdout,
+                    "stderr": stderr,
+                },
                 200,
             )
 
+    except RunAborted as e:
+        return e.response
     except ConnectionError as e:
         logging.error(f"Connection Error: {e}")
-        return jsonify({"error": str(e)}), 503
+        return fastjson({"error": str(e)}, 503)
     except Exception as e:
         logging.exception("An unexpected error occurred in /run endpoint")
-        return (
-            jsonify({"error": f"An internal server error occurred: {str(e)}"}),
-            500,
+        return fastjson(
+            {"error": f"An internal server error occurred: {str(e)}"}, 500
         )
-    finally:
-        if os.path.exists(temp_dir):
+@app.route("/run-stream", methods=["GET"])
+def run_function_stream():
+    """Like /run, but streams the container's output as it is produced.
+
+    The body is the raw interleaved stdout/stderr, followed by a final line
+    holding ``{"exit_code": N}``.
+    """
+    object_key = str(request.args.get("KEY"))
+
+    try:
+        _, script_bytes, prepared = begin_run(object_key, prepare=True)
+        api = get_docker().api
+        container_id = None
+
+        def cleanup():
             try:
-                shutil.rmtree(temp_dir)
-                logging.info(f"Cleaned up temporary directory: {temp_dir}")
+                if container_id is not None:
+                    api.remove_container(container_id, force=True)
             except Exception as e:
-                logging.error(
-                    f"Error cleaning up temporary directory {temp_dir}: {e}"
-                )
+                logging.error(f"Error removing container {container_id[:12]}: {e}")
+            finally:
+                run_slots.release()
+
+        try:
+            container_id = prepared.result()
+            start_with_stdin(api, container_id, script_bytes)
+        except Exception:
+            cleanup()
+            raise
+
+        def generate():
+            for chunk in api.logs(
+                container_id, stdout=True, stderr=True, stream=True, follow=True
+            ):
+                yield chunk
+            exit_code = api.wait(container_id)["StatusCode"]
+            yield b"\n" + orjson.dumps({"exit_code": exit_code}) + b"\n"
+
+        response = Response(generate(), mimetype="application/octet-stream")
+        # Runs once the body is sent or the client goes away.
+        response.call_on_close(cleanup)
+        return response
+
+    except RunAborted as e:
+        return e.response
+    except ConnectionError as e:
+        logging.error(f"Connection Error: {e}")
+        return fastjson({"error": str(e)}, 503)
+    except Exception as e:
+        logging.exception("An unexpected error occurred in /run-stream endpoint")
+        return fastjson(
+            {"error": f"An internal server error occurred: {str(e)}"}, 500
+        )
 @app.route("/upload", methods=["POST"])
 def upload_python_file():
-    if not swift_conn:
-        return (
-            jsonify({"error": "Swift client not initialized."}),
-            503,
-        )
+    store = get_store()
+    if not store:
+        return fastjson({"error": "Storage client not initialized."}, 503)
 
     # Check if the request has the file part
     if "file" not in request.files:
-        return jsonify({"error": "No file part in the request."}), 400
+        return fastjson({"error": "No file part in the request."}, 400)
 
     file = request.files["file"]
 
     if file.filename == "":
-        return jsonify({"error": "No selected file."}), 400
+        return fastjson({"error": "No selected file."}, 400)
 
     # Only allow .py files
     if not file.filename.endswith(".py"):
-        return jsonify({"error": "Only .py files are allowed."}), 400
-
-    # Generate a unique object key (or use the filename)
-    object_key = f"{uuid.uuid4().hex}_{file.filename}"
+        return fastjson({"error": "Only .py files are allowed."}, 400)
 
     try:
-        # Read file content
-        file_content = file.read()
-
-        # Upload to Swift
-        swift_conn.put_object(
-            container=DEFAULT_CONTAINER_NAME,
-            obj=object_key,
-            contents=file_content,
-            content_type="text/x-python"
+        # Key objects by a hash of their content, computed chunk by chunk from
+        # the spooled upload, so re-uploading the same script reuses its object.
+        stream = file.stream
+        stream.seek(0)
+        digest = hashlib.blake2b(digest_size=16)
+        for chunk in iter(lambda: stream.read(UPLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+        object_key = f"{digest.hexdigest()}.py"
+        content_length = stream.tell()
+        stream.seek(0)
+
+        if store.exists(object_key):
+            logging.info(
+                f"File '{file.filename}' already stored as {store.url(object_key)}"
+            )
+            return fastjson(
+                {
+                    "message": "File already uploaded.",
+                    "object_key": object_key,
+                    "container": store.container,
+                },
+                200,
+            )
+
+        # Stream the spooled upload to storage instead of reading it into memory.
+        store.put_bytes(
+            object_key,
+            stream,
+            content_type="text/x-python",
+            content_length=content_length,
         )
+        with list_cache_lock:
+            list_cache["ts"] = None
+            list_cache["generation"] += 1
 
         logging.info(
-            f"Uploaded file '{file.filename}' as '{object_key}' to Swift container '{DEFAULT_CONTAINER_NAME}'"
+            f"Uploaded file '{file.filename}' as {store.url(object_key)}"
         )
 
-        return (
-            jsonify(
-                {
-                    "message": "File uploaded successfully.",
-                    "object_key": object_key,
-                    "container": DEFAULT_CONTAINER_NAME,
-                }
-            ),
+        return fastjson(
+            {
+                "message": "File uploaded successfully.",
+                "object_key": object_key,
+                "container": store.container,
+            },
             201,
         )
 
     except Exception as e:
-        logging.error(f"Error uploading file to Swift: {e}")
-        return jsonify({"error": f"Failed to upload file: {str(e)}"}), 500
+        logging.error(f"Error uploading file to {FAAS_BACKEND}: {e}")
+        return fastjson({"error": f"Failed to upload file: {str(e)}"}, 500)
 @app.route("/list-objects", methods=["GET"])
 def list_objects():
-    if not swift_conn:
-        return jsonify({"error": "Swift client not initialized."}), 503
+    store = get_store()
+    if not store:
+        return fastjson({"error": "Storage client not initialized."}, 503)
     try:
-        # List all objects in the default container
-        objects = swift_conn.get_container(DEFAULT_CONTAINER_NAME)[1]
-        object_keys = [obj["name"] for obj in objects]
-        return jsonify({"object_keys": object_keys}), 200
+        object_keys, etag = cached_listing()
+        if object_keys is None:
+            with list_refresh_lock:
+                # Another request may have refreshed while this one waited.
+                object_keys, etag = cached_listing()
+                if object_keys is None:
+                    object_keys, etag = refresh_listing(store)
+
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+        else:
+            response = fastjson({"object_keys": object_keys}, 200)
+        response.set_etag(etag)
+        return response
     except Exception as e:
-        logging.error(f"Error listing objects in Swift: {e}")
-        return jsonify({"error": f"Failed to list objects: {str(e)}"}), 500
+        logging.error(f"Error listing objects in {FAAS_BACKEND}: {e}")
+        return fastjson({"error": f"Failed to list objects: {str(e)}"}, 500)
 
 if __name__ == "__main__":
-    if not swift_conn:
-        print(
-            "ERROR: Swift Client not initialized. Check config and logs. Server will not start Swift operations."
-        )
-    if not docker_client:
+    if not get_store():
         print(
-            "ERROR: Docker Client not initialized. Check Docker daemon and logs. Server will not start container operations."
+            "ERROR: Storage Client not initialized. Check config and logs. Server will not start storage operations."
         )
+    prepare_image()
+    warm_up()
 
+    # Development server only; production runs under Gunicorn
+    # (gunicorn -c gunicorn.conf.py server:app).
     app.run(host="0.0.0.0", port=5000, debug=False)
@@ -0,0 +1,159 @@
+"""Object stores that hold the uploaded function code.
+
+Each store exposes the same small interface used by server.py:
+
+- ``get_bytes(key, etag=None)`` -> ``(etag, bytes)``; raises NotModified when
+  ``etag`` still matches and ObjectNotFound when the key doesn't exist.
+- ``put_bytes(key, data, content_type, content_length=None)``; ``data`` may
+  be bytes or a readable file object, which is streamed rather than buffered
+- ``exists(key)`` -> whether the key is already stored
+- ``list()`` -> list of object keys
+- ``url(key)`` -> human readable location used in logs and error messages
+
+Client libraries are imported when a store is constructed, so only the
+selected backend's dependencies are ever loaded.
+"""
+import functools
+import threading
+
+
+class ObjectNotFound(LookupError):
+    """The requested key doesn't exist in the store."""
+
+
+class NotModified(Exception):
+    """The object still matches the ETag passed to get_bytes."""
+
+
+class SwiftStore:
+    def __init__(
+        self,
+        container,
+        auth_url,
+        username,
+        password,
+        project_name,
+        user_domain_name="Default",
+        project_domain_name="Default",
+    ):
+        import swiftclient
+
+        self.container = container
+        self._client_exception = swiftclient.exceptions.ClientException
+        self._connection_factory = functools.partial(
+            swiftclient.Connection,
+            authurl=auth_url,
+            user=username,
+            key=password,
+            tenant_name=project_name,
+            auth_version="3",
+            os_options={
+                "user_domain_name": user_domain_name,
+                "project_domain_name": project_domain_name,
+            },
+        )
+        self._local = threading.local()
+
+    @property
+    def _conn(self):
+        # swiftclient.Connection swaps its token/URL/HTTP connection in place
+        # when it retries, so each request thread needs its own.
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connection_factory()
+        return conn
+
+    def url(self, key):
+        return f"swift://{self.container}/{key}"
+
+    def get_bytes(self, key, etag=None):
+        headers = {"If-None-Match": etag} if etag else {}
+        try:
+            resp_headers, contents = self._conn.get_object(
+                self.container, key, headers=headers
+            )
+        except self._client_exception as e:
+            if e.http_status == 304:
+                raise NotModified(key) from e
+            if e.http_status == 404:
+                raise ObjectNotFound(key) from e
+            raise
+        return resp_headers.get("etag"), contents
+
+    def put_bytes(self, key, data, content_type, content_length=None):
+        self._conn.put_object(
+            container=self.container,
+            obj=key,
+            contents=data,
+            content_length=content_length,
+            content_type=content_type,
+        )
+
+    def exists(self, key):
+        try:
+            self._conn.head_object(self.container, key)
+        except self._client_exception as e:
+            if e.http_status == 404:
+                return False
+            raise
+        return True
+
+    def list(self):
+        objects = self._conn.get_container(self.container, full_listing=True)[1]
+        return [obj["name"] for obj in objects]
+
+
+class S3Store:
+    def __init__(self, bucket, endpoint_url=None, max_pool_connections=64):
+        import boto3
+        from botocore.config import Config
+
+        self.container = bucket
+        self._client = boto3.session.Session().client(
+            "s3",
+            endpoint_url=endpoint_url,
+            config=Config(tcp_keepalive=True, max_pool_connections=max_pool_connections),
+        )
+        self._client_error = self._client.exceptions.ClientError
+        self._no_such_key = self._client.exceptions.NoSuchKey
+
+    def url(self, key):
+        return f"s3://{self.container}/{key}"
+
+    def get_bytes(self, key, etag=None):
+        kwargs = {"IfNoneMatch": etag} if etag else {}
+        try:
+            obj = self._client.get_object(Bucket=self.container, Key=key, **kwargs)
+        except self._no_such_key as e:
+            raise ObjectNotFound(key) from e
+        except self._client_error as e:
+            status = e.response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+            if status == 304:
+                raise NotModified(key) from e
+            if status == 404:
+                raise ObjectNotFound(key) from e
+            raise
+        return obj.get("ETag"), obj["Body"].read()
+
+    def put_bytes(self, key, data, content_type, content_length=None):
+        kwargs = {"ContentLength": content_length} if content_length is not None else {}
+        self._client.put_object(
+            Bucket=self.container, Key=key, Body=data, ContentType=content_type, **kwargs
+        )
+
+    def exists(self, key):
+        try:
+            self._client.head_object(Bucket=self.container, Key=key)
+        except self._client_error as e:
+            status = e.response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+            if status == 404:
+                return False
+            raise
+        return True
+
+    def list(self):
+        keys = []
+        paginator = self._client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.container):
+            keys.extend(obj["Key"] for obj in page.get("Contents", []))
+        return keys
@@ -0,0 +1,74 @@
+import json
+import os
+import struct
+import subprocess
+import sys
+import time
+
+import pytest
+
+RUNNER = os.path.join(os.path.dirname(__file__), os.pardir, "runner", "runner.py")
+
+
+@pytest.fixture
+def runner(tmp_path):
+    proc = subprocess.Popen(
+        [sys.executable, RUNNER],
+        cwd=tmp_path,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        env={"FAAS_PRELOAD": "json, not_a_module"},
+    )
+
+    def run(source):
+        proc.stdin.write(struct.pack(">I", len(source)) + source)
+        proc.stdin.flush()
+        (length,) = struct.unpack(">I", proc.stdout.read(4))
+        return json.loads(proc.stdout.read(length))
+
+    yield run
+    proc.stdin.close()
+    assert proc.wait(timeout=5) == 0
+
+
+def test_runs_script_as_main(runner, tmp_path):
+    result = runner(b"import sys\nprint(__name__, sys.argv)\nprint('oops', file=sys.stderr)")
+    assert result == {
+        "exit_code": 0,
+        "stdout": f"__main__ {[str(tmp_path / 'script.py')]}\n",
+        "stderr": "oops\n",
+    }
+
+
+def test_exit_status(runner):
+    assert runner(b"raise SystemExit(3)")["exit_code"] == 3
+    result = runner(b"1 / 0")
+    assert result["exit_code"] == 1
+    assert result["stderr"].startswith("Traceback")
+    assert "runner.py" not in result["stderr"]
+    assert result["stderr"].endswith("ZeroDivisionError: division by zero\n")
+
+
+def test_scripts_are_isolated(runner):
+    runner(b"import json\njson.leak = 1\nopen('leak.txt', 'w').write('x')")
+    result = runner(b"import json, os\nprint(hasattr(json, 'leak'), os.listdir('.'))")
+    assert result["stdout"] == "False ['script.py']\n"
+
+
+def is_running(pid):
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            state = f.read().rsplit(")", 1)[1].split()[0]
+    except FileNotFoundError:
+        return False
+    return state != "Z"
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc"), reason="needs /proc")
+def test_background_processes_are_killed(runner):
+    result = runner(b"import subprocess\nprint(subprocess.Popen(['sleep', '30']).pid)")
+    pid = int(result["stdout"])
+    deadline = time.monotonic() + 1
+    while is_running(pid):
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
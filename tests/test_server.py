@@ -0,0 +1,410 @@
+import io
+import multiprocessing
+import queue
+import socket
+import struct
+import threading
+import time
+import types
+
+import orjson
+import pytest
+from cachetools import TTLCache
+from docker.errors import APIError
+
+import server
+from storage import NotModified, ObjectNotFound
+
+SLOTS = 2
+
+
+class FakeStore:
+    container = "faas-code"
+
+    def __init__(self):
+        self.objects = {"script.py": b"print('hi')"}
+        self.gets = []
+        self.lists = 0
+        self.on_list = None
+
+    def url(self, key):
+        return f"fake://{self.container}/{key}"
+
+    def get_bytes(self, key, etag=None):
+        self.gets.append((key, etag))
+        if key not in self.objects:
+            raise ObjectNotFound(key)
+        if etag == "etag":
+            raise NotModified(key)
+        return "etag", self.objects[key]
+
+    def put_bytes(self, key, data, content_type, content_length=None):
+        self.objects[key] = data.read()
+
+    def exists(self, key):
+        return key in self.objects
+
+    def list(self):
+        self.lists += 1
+        keys = sorted(self.objects)
+        if self.on_list:
+            self.on_list()
+        return keys
+
+
+class FakeSocket:
+    def sendall(self, data):
+        pass
+
+    def shutdown(self, how):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeDockerAPI:
+    def __init__(self):
+        self.created = []
+        self.removed = []
+        self.fail_create = False
+
+    def create_host_config(self, **kwargs):
+        return kwargs
+
+    def create_container(self, **kwargs):
+        if self.fail_create:
+            raise APIError("create failed")
+        container_id = f"container{len(self.created)}"
+        self.created.append(container_id)
+        return {"Id": container_id}
+
+    def attach_socket(self, container_id, params=None):
+        return FakeSocket()
+
+    def start(self, container_id):
+        pass
+
+    def wait(self, container_id):
+        return {"StatusCode": 0}
+
+    def logs(self, container_id, stdout=True, stderr=True, stream=False, follow=False):
+        if stream:
+            return iter([b"hi\n"])
+        return b"hi\n" if stdout else b""
+
+    def remove_container(self, container_id, force=False):
+        self.removed.append(container_id)
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = FakeStore()
+    monkeypatch.setattr(server, "get_store", lambda: store)
+    monkeypatch.setattr(server, "code_cache", TTLCache(maxsize=8, ttl=60))
+    monkeypatch.setattr(
+        server, "list_cache", {"ts": None, "keys": [], "etag": "", "generation": 0}
+    )
+    monkeypatch.setattr(server, "LIST_CACHE_TTL", 60)
+    return store
+
+
+@pytest.fixture
+def api(monkeypatch):
+    api = FakeDockerAPI()
+    monkeypatch.setattr(server, "get_docker", lambda: types.SimpleNamespace(api=api))
+    monkeypatch.setattr(server, "get_image", lambda: "sha256:test")
+    return api
+
+
+@pytest.fixture
+def client(monkeypatch, store, api):
+    monkeypatch.setattr(server, "run_slots", multiprocessing.BoundedSemaphore(SLOTS))
+    monkeypatch.setattr(server, "RUN_QUEUE_TIMEOUT", 0.01)
+    monkeypatch.setattr(server, "WARM_POOL_SIZE", 0)
+    return server.app.test_client()
+
+
+def free_slots():
+    taken = 0
+    while server.run_slots.acquire(block=False):
+        taken += 1
+    for _ in range(taken):
+        server.run_slots.release()
+    return taken
+
+
+def wait_for(condition, timeout=1):
+    # Prepared containers are discarded by a Future callback on the prepare pool.
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_run_releases_slot(client, api):
+    resp = client.get("/run?KEY=script.py")
+    assert resp.status_code == 200
+    assert resp.get_json()["stdout"] == "hi\n"
+    assert free_slots() == SLOTS
+    assert api.removed == api.created == ["container0"]
+
+
+@pytest.mark.parametrize("path", ["/run", "/run-stream"])
+def test_not_initialized_returns_503(client, api, monkeypatch, path):
+    monkeypatch.setattr(server, "get_docker", lambda: None)
+    resp = client.get(f"{path}?KEY=script.py")
+    assert resp.status_code == 503
+    assert free_slots() == SLOTS
+    assert api.created == []
+
+
+@pytest.mark.parametrize("path", ["/run", "/run-stream"])
+def test_failed_download_discards_prepared_container(client, api, path):
+    resp = client.get(f"{path}?KEY=missing.py")
+    assert resp.status_code == 500
+    assert free_slots() == SLOTS
+    wait_for(lambda: api.removed == api.created == ["container0"])
+
+
+@pytest.mark.parametrize("path", ["/run", "/run-stream"])
+def test_no_free_slot_returns_429(client, api, path):
+    for _ in range(SLOTS):
+        server.run_slots.acquire()
+    try:
+        resp = client.get(f"{path}?KEY=script.py")
+        assert resp.status_code == 429
+        assert resp.headers["Retry-After"] == "1"
+        assert api.created == []
+    finally:
+        for _ in range(SLOTS):
+            server.run_slots.release()
+    assert free_slots() == SLOTS
+
+
+@pytest.mark.parametrize("path", ["/run", "/run-stream"])
+def test_failed_prepare_releases_slot(client, api, path):
+    api.fail_create = True
+    resp = client.get(f"{path}?KEY=script.py")
+    assert resp.status_code == 500
+    assert free_slots() == SLOTS
+    assert api.removed == []
+
+
+def test_run_stream_releases_slot_on_close(client, api):
+    resp = client.get("/run-stream?KEY=script.py")
+    assert resp.get_data() == b'hi\n\n{"exit_code":0}\n'
+    assert free_slots() == SLOTS - 1
+    resp.close()
+    assert free_slots() == SLOTS
+    assert api.removed == api.created == ["container0"]
+
+
+def test_run_stream_releases_slot_when_client_goes_away(client, api):
+    resp = client.get("/run-stream?KEY=script.py", buffered=False)
+    assert free_slots() == SLOTS - 1
+    resp.close()
+    assert free_slots() == SLOTS
+    assert api.removed == api.created == ["container0"]
+
+
+def test_warm_run_takes_slot_after_download(client, store, monkeypatch):
+    def fake_warm_run(image, command, script_bytes):
+        assert free_slots() == SLOTS - 1
+        return "hi\n", "", None
+
+    monkeypatch.setattr(server, "WARM_POOL_SIZE", 1)
+    monkeypatch.setattr(server, "run_in_warm_container", fake_warm_run)
+    assert client.get("/run?KEY=script.py").status_code == 200
+    assert free_slots() == SLOTS
+
+    # With every slot taken a bad key still fails fast, without queueing.
+    for _ in range(SLOTS):
+        server.run_slots.acquire()
+    try:
+        assert client.get("/run?KEY=missing.py").status_code == 500
+        assert client.get("/run?KEY=script.py").status_code == 429
+    finally:
+        for _ in range(SLOTS):
+            server.run_slots.release()
+    assert free_slots() == SLOTS
+
+
+class FakeRunner:
+    short_id = "runner"
+
+    def __init__(self, labels):
+        self.labels = labels
+        self.removed = False
+
+    def remove(self, force=False):
+        self.removed = True
+
+
+class FakeContainers:
+    def __init__(self, runners):
+        self.runners = runners
+
+    def list(self, all=False, filters=None):
+        key, _, value = filters["label"].partition("=")
+        return [
+            r for r in self.runners if key in r.labels and value in ("", r.labels[key])
+        ]
+
+
+def test_remove_runners_by_worker_pid(monkeypatch):
+    runners = [
+        FakeRunner({server.RUNNER_LABEL: "1", server.RUNNER_PID_LABEL: "101"}),
+        FakeRunner({server.RUNNER_LABEL: "1", server.RUNNER_PID_LABEL: "102"}),
+    ]
+    docker_client = types.SimpleNamespace(containers=FakeContainers(runners))
+    monkeypatch.setattr(server, "get_docker", lambda: docker_client)
+
+    server.remove_runners(101)
+    assert [r.removed for r in runners] == [True, False]
+    server.remove_runners()
+    assert [r.removed for r in runners] == [True, True]
+
+
+def docker_frame(stream, data):
+    return struct.pack(">BxxxL", stream, len(data)) + data
+
+
+def test_runner_reads_record_across_frames():
+    ours, theirs = socket.socketpair()
+    record = orjson.dumps({"exit_code": 0, "stdout": "hi\n", "stderr": ""})
+    payload = struct.pack(">I", len(record)) + record
+    theirs.sendall(
+        docker_frame(2, b"runner: can't preload numpy\n")
+        + docker_frame(1, payload[:3])
+        + docker_frame(1, payload[3:])
+    )
+    runner = server.Runner(types.SimpleNamespace(short_id="runner"), ours)
+    assert runner.run(b"print('hi')") == {"exit_code": 0, "stdout": "hi\n", "stderr": ""}
+    assert theirs.recv(64) == struct.pack(">I", 11) + b"print('hi')"
+
+    theirs.shutdown(socket.SHUT_WR)
+    with pytest.raises(EOFError):
+        runner.run(b"print('hi')")
+
+
+class FakeWarmRunner:
+    def __init__(self, result):
+        self.container = self.short_id = "runner"
+        self.result = result
+        self.stopped = False
+
+    def run(self, script_bytes):
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+    def stop(self):
+        self.stopped = True
+
+
+@pytest.fixture
+def warm_pool(monkeypatch, api):
+    pool = queue.Queue()
+    replacement = FakeWarmRunner(None)
+    monkeypatch.setattr(server, "warm_pool", pool)
+    monkeypatch.setattr(server, "start_runner", lambda image: replacement)
+    return pool, replacement
+
+
+def test_failed_script_keeps_warm_runner(warm_pool):
+    pool, _ = warm_pool
+    runner = FakeWarmRunner({"exit_code": 3, "stdout": "", "stderr": "boom\n"})
+    pool.put(runner)
+    stdout, stderr, error = server.run_in_warm_container(
+        "sha256:test", server.DEFAULT_CONTAINER_COMMAND, b"raise SystemExit(3)"
+    )
+    assert (stdout, stderr, error.exit_status) == ("", "boom\n", 3)
+    assert pool.get_nowait() is runner
+    assert not runner.stopped
+
+
+def test_broken_warm_runner_is_replaced(warm_pool):
+    pool, replacement = warm_pool
+    runner = FakeWarmRunner(EOFError("Runner closed its output"))
+    pool.put(runner)
+    _, _, error = server.run_in_warm_container(
+        "sha256:test", server.DEFAULT_CONTAINER_COMMAND, b"print('hi')"
+    )
+    assert isinstance(error, EOFError)
+    assert runner.stopped
+    assert pool.get_nowait() is replacement
+
+
+def upload(client, source=b"print('new')"):
+    resp = client.post(
+        "/upload",
+        data={"file": (io.BytesIO(source), "new.py")},
+        content_type="multipart/form-data",
+    )
+    assert resp.status_code == 201
+    return resp.get_json()["object_key"]
+
+
+def test_list_objects_served_from_cache(client, store, monkeypatch):
+    first = client.get("/list-objects")
+    second = client.get("/list-objects")
+    assert first.get_json() == second.get_json() == {"object_keys": ["script.py"]}
+    assert first.headers["ETag"] == second.headers["ETag"]
+    assert store.lists == 1
+
+    monkeypatch.setattr(server, "LIST_CACHE_TTL", 0)
+    client.get("/list-objects")
+    assert store.lists == 2
+
+
+@pytest.mark.parametrize(
+    "if_none_match, status",
+    [("{etag}", 304), ("W/{etag}", 304), ("*", 304), ('"other"', 200)],
+)
+def test_list_objects_if_none_match(client, if_none_match, status):
+    etag = client.get("/list-objects").headers["ETag"]
+    resp = client.get(
+        "/list-objects", headers={"If-None-Match": if_none_match.format(etag=etag)}
+    )
+    assert resp.status_code == status
+    assert resp.headers["ETag"] == etag
+
+
+def test_upload_invalidates_list_cache(client, store):
+    etag = client.get("/list-objects").headers["ETag"]
+    key = upload(client)
+    resp = client.get("/list-objects", headers={"If-None-Match": etag})
+    assert resp.status_code == 200
+    assert key in resp.get_json()["object_keys"]
+    assert store.lists == 2
+
+
+def test_listing_raced_by_upload_is_not_cached(client, store):
+    uploaded = []
+
+    def upload_during_list():
+        store.on_list = None
+        thread = threading.Thread(target=lambda: uploaded.append(upload(client)))
+        thread.start()
+        thread.join()
+
+    store.on_list = upload_during_list
+    # The listing started before the upload, so it is served but not kept.
+    assert client.get("/list-objects").get_json() == {"object_keys": ["script.py"]}
+    assert uploaded[0] in client.get("/list-objects").get_json()["object_keys"]
+    assert store.lists == 2
+
+
+def test_not_modified_restarts_code_cache_ttl(store, monkeypatch):
+    now = [0]
+    monkeypatch.setattr(
+        server, "code_cache", TTLCache(maxsize=8, ttl=60, timer=lambda: now[0])
+    )
+    assert server.download_code("script.py") == b"print('hi')"
+    now[0] = 50
+    assert server.download_code("script.py") == b"print('hi')"
+    # Past the first download's TTL, but the 304 at t=50 kept the entry.
+    now[0] = 100
+    assert server.download_code("script.py") == b"print('hi')"
+    assert store.gets == [("script.py", None), ("script.py", "etag"), ("script.py", "etag")]
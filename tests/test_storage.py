@@ -0,0 +1,200 @@
+import io
+import sys
+import threading
+import types
+
+import pytest
+
+from storage import NotModified, ObjectNotFound, S3Store, SwiftStore
+
+
+# --- Fake Swift client ---
+class FakeClientException(Exception):
+    def __init__(self, http_status):
+        super().__init__(f"HTTP {http_status}")
+        self.http_status = http_status
+
+
+class FakeSwiftConnection:
+    def __init__(self, **kwargs):
+        self.objects = {"script.py": ({"etag": "abc"}, b"print('hi')")}
+        self.puts = []
+
+    def get_object(self, container, key, headers=None):
+        if key not in self.objects:
+            raise FakeClientException(404)
+        resp_headers, contents = self.objects[key]
+        if headers and headers.get("If-None-Match") == resp_headers["etag"]:
+            raise FakeClientException(304)
+        return resp_headers, contents
+
+    def head_object(self, container, key):
+        if key not in self.objects:
+            raise FakeClientException(404)
+        return self.objects[key][0]
+
+    def put_object(self, container, obj, contents, content_length=None, content_type=None):
+        self.puts.append((obj, contents, content_length, content_type))
+
+    def get_container(self, container, full_listing=False):
+        # Swift returns at most 10,000 names per request.
+        names = sorted(self.objects) + [f"more-{i}.py" for i in range(10_000)]
+        if not full_listing:
+            names = names[:10_000]
+        return {}, [{"name": name} for name in names]
+
+
+@pytest.fixture
+def swift_store(monkeypatch):
+    fake = types.ModuleType("swiftclient")
+    fake.exceptions = types.SimpleNamespace(ClientException=FakeClientException)
+    fake.Connection = FakeSwiftConnection
+    monkeypatch.setitem(sys.modules, "swiftclient", fake)
+    return SwiftStore("faas-code", "http://auth", "user", "pass", "project")
+
+
+def test_swift_get_bytes(swift_store):
+    assert swift_store.get_bytes("script.py") == ("abc", b"print('hi')")
+
+
+def test_swift_matching_etag_raises_not_modified(swift_store):
+    with pytest.raises(NotModified):
+        swift_store.get_bytes("script.py", etag="abc")
+
+
+def test_swift_missing_key_raises_object_not_found(swift_store):
+    with pytest.raises(ObjectNotFound):
+        swift_store.get_bytes("missing.py")
+
+
+def test_swift_exists(swift_store):
+    assert swift_store.exists("script.py")
+    assert not swift_store.exists("missing.py")
+
+
+def test_swift_list_returns_full_listing(swift_store):
+    keys = swift_store.list()
+    assert len(keys) == 10_001
+    assert keys[-1] == "more-9999.py"
+
+
+def test_swift_put_bytes(swift_store):
+    stream = io.BytesIO(b"print('hi')")
+    swift_store.put_bytes("new.py", stream, "text/x-python", content_length=11)
+    assert swift_store._conn.puts == [("new.py", stream, 11, "text/x-python")]
+
+
+def test_swift_connection_per_thread(swift_store):
+    conns = []
+    thread = threading.Thread(target=lambda: conns.append(swift_store._conn))
+    thread.start()
+    thread.join()
+    assert swift_store._conn is swift_store._conn
+    assert conns[0] is not swift_store._conn
+
+
+# --- Fake S3 client ---
+class FakeClientError(Exception):
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.response = {"ResponseMetadata": {"HTTPStatusCode": status}}
+
+
+class FakeNoSuchKey(FakeClientError):
+    def __init__(self):
+        super().__init__(404)
+
+
+class FakeBody:
+    def __init__(self, data):
+        self.data = data
+
+    def read(self):
+        return self.data
+
+
+class FakeS3Client:
+    exceptions = types.SimpleNamespace(
+        ClientError=FakeClientError, NoSuchKey=FakeNoSuchKey
+    )
+
+    def __init__(self):
+        self.objects = {"script.py": ('"abc"', b"print('hi')")}
+        self.puts = []
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None):
+        if Key not in self.objects:
+            raise FakeNoSuchKey()
+        etag, data = self.objects[Key]
+        if IfNoneMatch == etag:
+            raise FakeClientError(304)
+        return {"ETag": etag, "Body": FakeBody(data)}
+
+    def head_object(self, Bucket, Key):
+        # HEAD has no body, so botocore raises a bare 404 ClientError.
+        if Key not in self.objects:
+            raise FakeClientError(404)
+        return {"ETag": self.objects[Key][0]}
+
+    def put_object(self, Bucket, Key, Body, ContentType, **kwargs):
+        self.puts.append((Key, Body, kwargs.get("ContentLength"), ContentType))
+
+    def get_paginator(self, operation):
+        assert operation == "list_objects_v2"
+        return FakePaginator()
+
+
+class FakePaginator:
+    def paginate(self, Bucket):
+        yield {"Contents": [{"Key": "a.py"}, {"Key": "b.py"}]}
+        yield {"Contents": [{"Key": "c.py"}]}
+        # S3 leaves Contents out of empty pages.
+        yield {}
+
+
+@pytest.fixture
+def s3_store(monkeypatch):
+    boto3 = types.ModuleType("boto3")
+    boto3.session = types.SimpleNamespace(
+        Session=lambda: types.SimpleNamespace(client=lambda *a, **kw: FakeS3Client())
+    )
+    botocore = types.ModuleType("botocore")
+    botocore_config = types.ModuleType("botocore.config")
+    botocore_config.Config = lambda **kwargs: kwargs
+    monkeypatch.setitem(sys.modules, "boto3", boto3)
+    monkeypatch.setitem(sys.modules, "botocore", botocore)
+    monkeypatch.setitem(sys.modules, "botocore.config", botocore_config)
+    return S3Store("faas-code")
+
+
+def test_s3_get_bytes(s3_store):
+    assert s3_store.get_bytes("script.py") == ('"abc"', b"print('hi')")
+
+
+def test_s3_matching_etag_raises_not_modified(s3_store):
+    with pytest.raises(NotModified):
+        s3_store.get_bytes("script.py", etag='"abc"')
+
+
+def test_s3_missing_key_raises_object_not_found(s3_store):
+    with pytest.raises(ObjectNotFound):
+        s3_store.get_bytes("missing.py")
+
+
+def test_s3_exists(s3_store):
+    assert s3_store.exists("script.py")
+    assert not s3_store.exists("missing.py")
+
+
+def test_s3_list_follows_pages(s3_store):
+    assert s3_store.list() == ["a.py", "b.py", "c.py"]
+
+
+def test_s3_put_bytes(s3_store):
+    stream = io.BytesIO(b"print('hi')")
+    s3_store.put_bytes("new.py", stream, "text/x-python", content_length=11)
+    s3_store.put_bytes("bytes.py", b"print('hi')", "text/x-python")
+    assert s3_store._client.puts == [
+        ("new.py", stream, 11, "text/x-python"),
+        ("bytes.py", b"print('hi')", None, "text/x-python"),
+    ]